@@ -1,16 +1,23 @@
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import inspect
 import json
 import os
 import pathlib
 import re
+import runpy
 import shutil
 import subprocess
 import sys
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
 
 import numpy as np
 import scipy.io
-from element_interface.utils import dict_to_uuid
 
 # import the spike sorting packages
 try:
@@ -21,6 +28,9 @@ try:
     from ecephys_spike_sorting.scripts.helpers import SpikeGLX_utils
 except Exception as e:
     print(f'Warning: Failed loading "ecephys_spike_sorting" package - {str(e)}')
+    _ecephys_importable = False
+else:
+    _ecephys_importable = True
 
 # import pykilosort package
 try:
@@ -28,6 +38,47 @@ try:
 except Exception as e:
     print(f'Warning: Failed loading "pykilosort" package - {str(e)}')
 
+_AP_META_RE = re.compile(r"(.*)_g(\d)_t(\d+|cat)\.imec(\d?)\.ap\.meta")
+
+# use orjson for the module-status files when available - its C parser/writer is
+# several times faster than the stdlib json on these small, frequent round-trips
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+    def _json_dumps(obj):
+        # OPT_PASSTHROUGH_DATETIME routes datetimes through default=str so both
+        # backends emit the same space-separated format _as_datetime parses
+        # (orjson would otherwise serialize them natively as ISO-8601 with "T")
+        return orjson.dumps(
+            obj, option=orjson.OPT_PASSTHROUGH_DATETIME, default=str
+        ).decode()
+
+    def _canonical_dumps(obj):
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            default=str,
+        )
+
+except ImportError:
+
+    def _json_loads(data):
+        return json.loads(data)
+
+    def _json_dumps(obj):
+        return json.dumps(obj, default=str)
+
+    def _canonical_dumps(obj):
+        # compact separators to stay byte-identical with orjson - the hash of
+        # this output names the on-disk status file, so it must not depend on
+        # which backend happens to be installed
+        return json.dumps(
+            obj, sort_keys=True, separators=(",", ":"), default=str
+        ).encode()
+
 
 class SGLXKilosortPipeline:
     """
@@ -46,6 +97,10 @@ class SGLXKilosortPipeline:
         "quality_metrics",
     ]
 
+    # these modules only read the finished kilosort output and are
+    # independent of each other - they can safely run concurrently
+    _parallel_modules = ["noise_templates", "mean_waveforms", "quality_metrics"]
+
     _default_catgt_params = {
         "catGT_car_mode": "gblcar",
         "catGT_loccar_min_um": 40,
@@ -55,7 +110,7 @@ class SGLXKilosortPipeline:
         "ni_extract_string": "-XA=0,1,3,500 -iXA=1,3,3,0  -XD=-1,1,50 -XD=-1,2,1.7 -XD=-1,3,5 -iXD=-1,3,5",
     }
 
-    _input_json_args = list(inspect.signature(createInputJson).parameters)
+    _input_json_args = frozenset(inspect.signature(createInputJson).parameters)
 
     def __init__(
         self,
@@ -66,20 +121,32 @@ class SGLXKilosortPipeline:
         run_CatGT=False,
         ni_present=False,
         ni_extract_string=None,
+        max_parallel=3,
     ):
         self._npx_input_dir = pathlib.Path(npx_input_dir)
 
         self._ks_output_dir = pathlib.Path(ks_output_dir)
         self._ks_output_dir.mkdir(parents=True, exist_ok=True)
 
+        # posix-string forms of the fixed directories - handed to createInputJson
+        # repeatedly, so convert once here instead of at every call site
+        self._npx_input_posix = self._npx_input_dir.as_posix()
+        self._ks_output_posix = self._ks_output_dir.as_posix()
+
         self._params = params
         self._KS2ver = KS2ver
         self._run_CatGT = run_CatGT
-        self._run_CatGT = run_CatGT
-        self._default_catgt_params["ni_present"] = ni_present
-        self._default_catgt_params["ni_extract_string"] = (
-            ni_extract_string or self._default_catgt_params["ni_extract_string"]
-        )
+        # copy the defaults per instance - assigning into the class-level dict
+        # would leak one object's ni_* settings into every other instance
+        # (a real hazard when running several probes' pipelines in parallel)
+        self._default_catgt_params = {
+            **type(self)._default_catgt_params,
+            "ni_present": ni_present,
+            "ni_extract_string": (
+                ni_extract_string
+                or type(self)._default_catgt_params["ni_extract_string"]
+            ),
+        }
 
         self._json_directory = self._ks_output_dir / "json_configs"
         self._json_directory.mkdir(parents=True, exist_ok=True)
@@ -95,12 +162,54 @@ class SGLXKilosortPipeline:
         self.ks_input_params = None
         self._modules_input_hash = None
         self._modules_input_hash_fp = None
+        self._modules_status_cache = None
+        self._parsed_filename = None
+        self._raw_fp_cache = {}
+        self._dir_cache = {}
+        # cap on concurrently running modules - set to 1 to disable parallelism
+        # (e.g. if RAM is too scarce for several modules at once)
+        self._max_parallel = max(int(max_parallel), 1)
+        self._modules_status_lock = threading.Lock()
+
+    def _scan_dir(self, directory):
+        """
+        List a directory's entry names through a per-instance cache - one
+        os.scandir (readdir) pass instead of a fresh enumeration per glob,
+        which matters on network mounts where every listing is a round-trip
+        """
+        directory = pathlib.Path(directory)
+        if directory not in self._dir_cache:
+            with os.scandir(directory) as it:
+                self._dir_cache[directory] = [entry.name for entry in it]
+        return self._dir_cache[directory]
+
+    def _invalidate_dir_cache(self, directory=None):
+        if directory is None:
+            self._dir_cache.clear()
+        else:
+            self._dir_cache.pop(pathlib.Path(directory), None)
 
     def parse_input_filename(self):
-        meta_filename = next(self._npx_input_dir.glob("*.ap.meta")).name
-        match = re.search("(.*)_g(\d)_t(\d+|cat)\.imec(\d?)\.ap\.meta", meta_filename)
-        session_str, gate_str, trigger_str, probe_str = match.groups()
-        return session_str, gate_str, trigger_str, probe_str or "0"
+        # memoized - the input directory content is static for the lifetime of this object,
+        # no need to re-glob and re-match on every call
+        if self._parsed_filename is None:
+            try:
+                meta_filename = next(
+                    name
+                    for name in self._scan_dir(self._npx_input_dir)
+                    if name.endswith(".ap.meta")
+                )
+            except FileNotFoundError:
+                raise RuntimeError(f"No .ap.meta file found in {self._npx_input_dir}")
+            match = _AP_META_RE.search(meta_filename)
+            session_str, gate_str, trigger_str, probe_str = match.groups()
+            self._parsed_filename = (
+                session_str,
+                gate_str,
+                trigger_str,
+                probe_str or "0",
+            )
+        return self._parsed_filename
 
     def generate_CatGT_input_json(self):
         if not self._run_CatGT:
@@ -109,46 +218,63 @@ class SGLXKilosortPipeline:
 
         session_str, gate_str, trig_str, probe_str = self.parse_input_filename()
 
-        first_trig, last_trig = SpikeGLX_utils.ParseTrigStr(
-            "start,end", probe_str, gate_str, self._npx_input_dir.as_posix()
-        )
-        trigger_str = repr(first_trig) + "," + repr(last_trig)
-
         self._catGT_input_json = (
             self._json_directory / f"{session_str}{probe_str}_CatGT-input.json"
         )
 
-        catgt_params = {
-            k: self._params.get(k, v) for k, v in self._default_catgt_params.items()
-        }
-
-        ni_present = catgt_params.pop("ni_present")
-        ni_extract_string = catgt_params.pop("ni_extract_string")
-
-        catgt_params["catGT_stream_string"] = "-ap -ni" if ni_present else "-ap"
-        sync_extract = "-SY=" + probe_str + ",-1,6,500"
-        extract_string = sync_extract + (f" {ni_extract_string}" if ni_present else "")
-        catgt_params["catGT_cmd_string"] += f" {extract_string}"
-
         input_meta_fullpath, continuous_file = self._get_raw_data_filepaths()
 
-        # create symbolic link to the actual data files - as CatGT expects files to follow a certain naming convention
+        # CatGT reads its input through symbolic links following a certain
+        # naming convention - computed up front so the early-out below can
+        # verify they are still in place
         continuous_file_symlink = (
             continuous_file.parent
             / f"{session_str}_g{gate_str}"
             / f"{session_str}_g{gate_str}_imec{probe_str}"
             / f"{session_str}_g{gate_str}_t{trig_str}.imec{probe_str}.ap.bin"
         )
-        continuous_file_symlink.parent.mkdir(parents=True, exist_ok=True)
-        if continuous_file_symlink.exists():
-            continuous_file_symlink.unlink()
-        continuous_file_symlink.symlink_to(continuous_file)
         input_meta_fullpath_symlink = (
             input_meta_fullpath.parent
             / f"{session_str}_g{gate_str}"
             / f"{session_str}_g{gate_str}_imec{probe_str}"
             / f"{session_str}_g{gate_str}_t{trig_str}.imec{probe_str}.ap.meta"
         )
+
+        # incremental-rebuild style early-out - an input JSON newer than the
+        # source meta file is still valid, provided the symlinks CatGT reads
+        # from were not cleaned up in the meantime
+        if (
+            self._catGT_input_json.exists()
+            and self._catGT_input_json.stat().st_mtime
+            > input_meta_fullpath.stat().st_mtime
+            and continuous_file_symlink.is_symlink()
+            and input_meta_fullpath_symlink.is_symlink()
+        ):
+            return
+
+        first_trig, last_trig = SpikeGLX_utils.ParseTrigStr(
+            "start,end", probe_str, gate_str, self._npx_input_posix
+        )
+        trigger_str = repr(first_trig) + "," + repr(last_trig)
+
+        catgt_params = {
+            k: self._params.get(k, v) for k, v in self._default_catgt_params.items()
+        }
+
+        ni_present = catgt_params.pop("ni_present")
+        ni_extract_string = catgt_params.pop("ni_extract_string")
+
+        catgt_params["catGT_stream_string"] = "-ap -ni" if ni_present else "-ap"
+        sync_extract = f"-SY={probe_str},-1,6,500"
+        extract_string = (
+            f"{sync_extract} {ni_extract_string}" if ni_present else sync_extract
+        )
+        catgt_params["catGT_cmd_string"] += f" {extract_string}"
+
+        continuous_file_symlink.parent.mkdir(parents=True, exist_ok=True)
+        if continuous_file_symlink.exists():
+            continuous_file_symlink.unlink()
+        continuous_file_symlink.symlink_to(continuous_file)
         input_meta_fullpath_symlink.parent.mkdir(parents=True, exist_ok=True)
         if input_meta_fullpath_symlink.exists():
             input_meta_fullpath_symlink.unlink()
@@ -157,7 +283,7 @@ class SGLXKilosortPipeline:
         createInputJson(
             self._catGT_input_json.as_posix(),
             KS2ver=self._KS2ver,
-            npx_directory=self._npx_input_dir.as_posix(),
+            npx_directory=self._npx_input_posix,
             spikeGLX_data=True,
             catGT_run_name=session_str,
             gate_string=gate_str,
@@ -165,9 +291,9 @@ class SGLXKilosortPipeline:
             probe_string=probe_str,
             continuous_file=continuous_file.as_posix(),
             input_meta_path=input_meta_fullpath.as_posix(),
-            extracted_data_directory=self._ks_output_dir.as_posix(),
-            kilosort_output_directory=self._ks_output_dir.as_posix(),
-            kilosort_output_tmp=self._ks_output_dir.as_posix(),
+            extracted_data_directory=self._ks_output_posix,
+            kilosort_output_directory=self._ks_output_posix,
+            kilosort_output_tmp=self._ks_output_posix,
             kilosort_repository=_get_kilosort_repository(self._KS2ver),
             **{k: v for k, v in catgt_params.items() if k in self._input_json_args},
         )
@@ -182,18 +308,13 @@ class SGLXKilosortPipeline:
                 "CatGT-input.json", "CatGT-output.json"
             )
 
-            command = (
-                sys.executable
-                + " -W ignore -m ecephys_spike_sorting.modules."
-                + "catGT_helper"
-                + " --input_json "
-                + catGT_input_json
-                + " --output_json "
-                + catGT_output_json
-            )
-            subprocess.check_call(command.split(" "))
+            _spawn_module("catGT_helper", catGT_input_json, catGT_output_json)
 
             self._CatGT_finished = True
+            # the pre-CatGT filepaths are no longer the ones to sort from, and
+            # CatGT has just populated its destination directory
+            self._raw_fp_cache.pop(False, None)
+            self._invalidate_dir_cache()
 
     def generate_modules_input_json(self):
         session_str, _, _, probe_str = self.parse_input_filename()
@@ -206,21 +327,20 @@ class SGLXKilosortPipeline:
         params = {}
         for k, v in self._params.items():
             value = str(v) if isinstance(v, list) else v
-            if f"ks_{k}" in self._input_json_args:
-                params[f"ks_{k}"] = value
-            if k in self._input_json_args:
-                params[k] = value
+            for valid_key in (k, f"ks_{k}"):
+                if valid_key in self._input_json_args:
+                    params[valid_key] = value
 
         self.ks_input_params = createInputJson(
             self._module_input_json.as_posix(),
             KS2ver=self._KS2ver,
-            npx_directory=self._npx_input_dir.as_posix(),
+            npx_directory=self._npx_input_posix,
             spikeGLX_data=True,
             continuous_file=continuous_file.as_posix(),
             input_meta_path=input_meta_fullpath.as_posix(),
-            extracted_data_directory=self._ks_output_dir.as_posix(),
-            kilosort_output_directory=self._ks_output_dir.as_posix(),
-            kilosort_output_tmp=self._ks_output_dir.as_posix(),
+            extracted_data_directory=self._ks_output_posix,
+            kilosort_output_directory=self._ks_output_posix,
+            kilosort_output_tmp=self._ks_output_posix,
             ks_make_copy=True,
             noise_template_use_rf=self._params.get("noise_template_use_rf", False),
             c_Waves_snr_um=self._params.get("c_Waves_snr_um", 160),
@@ -229,9 +349,18 @@ class SGLXKilosortPipeline:
             **params,
         )
 
-        self._modules_input_hash = dict_to_uuid(dict(self._params, KS2ver=self._KS2ver))
+        if self._modules_input_hash is None:
+            # params and KS version are fixed for this object - compute once
+            self._modules_input_hash = _fast_dict_hash(
+                dict(self._params, KS2ver=self._KS2ver)
+            )
 
     def run_modules(self, modules_to_run=None):
+        modules = modules_to_run or self._modules
+        if self._all_modules_completed(modules):
+            print("---- All modules already completed - skipping ----")
+            return
+
         if self._run_CatGT and not self._CatGT_finished:
             self.run_CatGT()
 
@@ -240,50 +369,88 @@ class SGLXKilosortPipeline:
         module_input_json = self._module_input_json.as_posix()
         module_logfile = self._module_logfile.as_posix()
 
-        modules = modules_to_run or self._modules
+        # the kilosort modules must run in order; the downstream modules
+        # only depend on the kilosort output and can run concurrently
+        sequential_modules = [m for m in modules if m not in self._parallel_modules]
+        parallel_modules = [m for m in modules if m in self._parallel_modules]
+
+        # open the run log once, line-buffered, shared by all modules
+        # (fewer open/close syscalls and friendlier to "tail -f")
+        with open(module_logfile, "a", buffering=1) as log_f:
+            for module in sequential_modules:
+                self._run_one_module(module, module_input_json, log_f)
+
+            if len(parallel_modules) > 1 and self._max_parallel > 1:
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(self._max_parallel, len(parallel_modules))
+                ) as executor:
+                    futures = [
+                        executor.submit(
+                            self._run_one_module,
+                            module,
+                            module_input_json,
+                            log_f,
+                            allow_in_process=False,
+                        )
+                        for module in parallel_modules
+                    ]
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+            else:
+                for module in parallel_modules:
+                    self._run_one_module(module, module_input_json, log_f)
 
-        for module in modules:
-            module_status = self._get_module_status(module)
-            if module_status["completion_time"] is not None:
-                continue
+        self._update_total_duration()
 
-            module_output_json = self._get_module_output_json_filename(module)
-            command = (
-                sys.executable
-                + " -W ignore -m ecephys_spike_sorting.modules."
-                + module
-                + " --input_json "
-                + module_input_json
-                + " --output_json "
-                + module_output_json
-            )
+    def _run_one_module(self, module, module_input_json, log_f, allow_in_process=True):
+        module_status = self._get_module_status(module)
+        if module_status["completion_time"] is not None:
+            return
 
-            start_time = datetime.utcnow()
-            self._update_module_status(
-                {
-                    module: {
-                        "start_time": start_time,
-                        "completion_time": None,
-                        "duration": None,
-                    }
+        module_output_json = self._get_module_output_json_filename(module)
+
+        # duration is measured on the monotonic clock - immune to wall-clock steps
+        start_time = datetime.utcnow()
+        t0 = time.perf_counter_ns()
+        log_f.write(f"\n---- {module} - started at {start_time} ----\n")
+        self._update_module_status(
+            {
+                module: {
+                    "start_time": start_time,
+                    "completion_time": None,
+                    "duration": None,
                 }
+            }
+        )
+        if _ecephys_importable and allow_in_process:
+            # in-process execution patches sys.argv/stdout - sequential runs only
+            _run_module_in_process(module, module_input_json, module_output_json, log_f)
+        else:
+            _spawn_module(
+                module,
+                module_input_json,
+                module_output_json,
+                stdout=log_f,
+                stderr=subprocess.STDOUT,
             )
-            with open(module_logfile, "a") as f:
-                subprocess.check_call(command.split(" "), stdout=f)
-            completion_time = datetime.utcnow()
-            self._update_module_status(
-                {
-                    module: {
-                        "start_time": start_time,
-                        "completion_time": completion_time,
-                        "duration": (completion_time - start_time).total_seconds(),
-                    }
+        duration = (time.perf_counter_ns() - t0) / 1e9
+        completion_time = datetime.utcnow()
+        self._update_module_status(
+            {
+                module: {
+                    "start_time": start_time,
+                    "completion_time": completion_time,
+                    "duration": duration,
                 }
-            )
-
-        self._update_total_duration()
+            }
+        )
 
     def _get_raw_data_filepaths(self):
+        # cached per CatGT state - the same globs are repeated by
+        # generate_CatGT_input_json and generate_modules_input_json
+        if self._CatGT_finished in self._raw_fp_cache:
+            return self._raw_fp_cache[self._CatGT_finished]
+
         session_str, gate_str, _, probe_str = self.parse_input_filename()
 
         if self._CatGT_finished:
@@ -294,17 +461,59 @@ class SGLXKilosortPipeline:
             data_directory = catGT_dest / run_folder / prb_folder
         else:
             data_directory = self._npx_input_dir
+
+        # one cached directory listing picks up both files (instead of two
+        # full enumerations), bailing out as soon as both are found
         try:
-            meta_fp = next(data_directory.glob(f"{session_str}*.ap.meta"))
-            bin_fp = next(data_directory.glob(f"{session_str}*.ap.bin"))
-        except StopIteration:
+            dir_listing = self._scan_dir(data_directory)
+        except FileNotFoundError:
+            # a missing CatGT destination directory reads the same as an
+            # empty one - keep the original diagnostic
+            raise RuntimeError(
+                f"No ap meta/bin files found in {data_directory} - CatGT error?"
+            )
+        meta_fp = bin_fp = None
+        for name in dir_listing:
+            if not name.startswith(session_str):
+                continue
+            if meta_fp is None and name.endswith(".ap.meta"):
+                meta_fp = data_directory / name
+            elif bin_fp is None and name.endswith(".ap.bin"):
+                bin_fp = data_directory / name
+            if meta_fp is not None and bin_fp is not None:
+                break
+        if meta_fp is None or bin_fp is None:
             raise RuntimeError(
                 f"No ap meta/bin files found in {data_directory} - CatGT error?"
             )
 
+        self._raw_fp_cache[self._CatGT_finished] = (meta_fp, bin_fp)
         return meta_fp, bin_fp
 
-    def _update_module_status(self, updated_module_status={}):
+    def _all_modules_completed(self, modules):
+        """
+        Cheap completion probe - reads the expected status file directly so a
+        fully-completed rerun can return before regenerating the input JSONs
+        (createInputJson re-probes the recording metadata, which is expensive)
+        """
+        hash_fp = (
+            self._json_directory
+            / f".{_fast_dict_hash(dict(self._params, KS2ver=self._KS2ver))}.json"
+        )
+        if not hash_fp.exists():
+            return False
+        with open(hash_fp) as f:
+            modules_status = _json_loads(f.read())
+        return all(
+            modules_status.get(m, {}).get("completion_time") is not None
+            for m in modules
+        )
+
+    def _load_modules_status(self):
+        """
+        Load the module-status file into the in-memory cache - parsed once per run
+        instead of re-read for every module
+        """
         if self._modules_input_hash is None:
             raise RuntimeError('"generate_modules_input_json()" not yet performed!')
 
@@ -313,8 +522,7 @@ class SGLXKilosortPipeline:
         )
         if self._modules_input_hash_fp.exists():
             with open(self._modules_input_hash_fp) as f:
-                modules_status = json.load(f)
-            modules_status = {**modules_status, **updated_module_status}
+                self._modules_status_cache = _json_loads(f.read())
         else:
             # handle cases of processing rerun on different parameters (the hash changes)
             # delete outdated files
@@ -324,20 +532,39 @@ class SGLXKilosortPipeline:
                 if f.is_file() and f.name != self._module_input_json.name
             ]
 
-            modules_status = {
+            self._modules_status_cache = {
                 module: {"start_time": None, "completion_time": None, "duration": None}
                 for module in self._modules
             }
-        with open(self._modules_input_hash_fp, "w") as f:
-            json.dump(modules_status, f, default=str)
+            self._flush_modules_status()
+        return self._modules_status_cache
+
+    def _flush_modules_status(self):
+        # write-temp-then-rename (atomic on POSIX and Windows) so a crash
+        # mid-write cannot corrupt the status file - losing it would re-run
+        # every module, including kilosort itself
+        tmp_fp = self._modules_input_hash_fp.with_suffix(".json.tmp")
+        with open(tmp_fp, "w") as f:
+            f.write(_json_dumps(self._modules_status_cache))
+        os.replace(tmp_fp, self._modules_input_hash_fp)
 
-    def _get_module_status(self, module):
-        if self._modules_input_hash_fp is None:
-            self._update_module_status()
+    def _update_module_status(self, updated_module_status={}):
+        # merge-and-write must be atomic w.r.t. concurrently running modules
+        with self._modules_status_lock:
+            if self._modules_status_cache is None:
+                self._load_modules_status()
+            self._modules_status_cache.update(updated_module_status)
+            self._flush_modules_status()
 
-        if self._modules_input_hash_fp.exists():
-            with open(self._modules_input_hash_fp) as f:
-                modules_status = json.load(f)
+    def _get_module_status(self, module):
+        # locked like _update_module_status - workers of the parallel stage may
+        # race to lazily initialize the cache (whose miss branch deletes files)
+        # or to mutate a module's entry
+        with self._modules_status_lock:
+            if self._modules_status_cache is None:
+                self._load_modules_status()
+
+            modules_status = self._modules_status_cache
             if modules_status[module]["completion_time"] is None:
                 # additional logic to read from the "-output.json" file for this module as well
                 # handle cases where the module has finished successfully,
@@ -348,17 +575,15 @@ class SGLXKilosortPipeline:
                 )
                 if module_output_json_fp.exists():
                     with open(module_output_json_fp) as f:
-                        module_run_output = json.load(f)
+                        module_run_output = _json_loads(f.read())
                     modules_status[module]["duration"] = module_run_output[
                         "execution_time"
                     ]
-                    modules_status[module]["completion_time"] = datetime.strptime(
-                        modules_status[module]["start_time"], "%Y-%m-%d %H:%M:%S.%f"
+                    modules_status[module]["completion_time"] = _as_datetime(
+                        modules_status[module]["start_time"]
                     ) + timedelta(seconds=module_run_output["execution_time"])
             return modules_status[module]
 
-        return {"start_time": None, "completion_time": None, "duration": None}
-
     def _get_module_output_json_filename(self, module):
         module_input_json = self._module_input_json.as_posix()
         module_output_json = module_input_json.replace(
@@ -368,8 +593,7 @@ class SGLXKilosortPipeline:
         return module_output_json
 
     def _update_total_duration(self):
-        with open(self._modules_input_hash_fp) as f:
-            modules_status = json.load(f)
+        modules_status = self._modules_status_cache or self._load_modules_status()
         cumulative_execution_duration = sum(
             v["duration"] or 0
             for k, v in modules_status.items()
@@ -390,11 +614,7 @@ class SGLXKilosortPipeline:
             return
 
         total_duration = (
-            datetime.strptime(
-                last_completion_time,
-                "%Y-%m-%d %H:%M:%S.%f",
-            )
-            - datetime.strptime(first_start_time, "%Y-%m-%d %H:%M:%S.%f")
+            _as_datetime(last_completion_time) - _as_datetime(first_start_time)
         ).total_seconds()
         self._update_module_status(
             {
@@ -425,7 +645,7 @@ class OpenEphysKilosortPipeline:
         "quality_metrics",
     ]
 
-    _input_json_args = list(inspect.signature(createInputJson).parameters)
+    _input_json_args = frozenset(inspect.signature(createInputJson).parameters)
 
     def __init__(
         self, npx_input_dir: str, ks_output_dir: str, params: dict, KS2ver: str
@@ -435,6 +655,11 @@ class OpenEphysKilosortPipeline:
         self._ks_output_dir = pathlib.Path(ks_output_dir)
         self._ks_output_dir.mkdir(parents=True, exist_ok=True)
 
+        # posix-string forms of the fixed directories - handed to createInputJson
+        # repeatedly, so convert once here instead of at every call site
+        self._npx_input_posix = self._npx_input_dir.as_posix()
+        self._ks_output_posix = self._ks_output_dir.as_posix()
+
         self._params = params
         self._KS2ver = KS2ver
 
@@ -451,6 +676,7 @@ class OpenEphysKilosortPipeline:
         self.ks_input_params = None
         self._modules_input_hash = None
         self._modules_input_hash_fp = None
+        self._modules_status_cache = None
 
     def make_chanmap_file(self):
         continuous_file = self._npx_input_dir / "continuous.dat"
@@ -475,7 +701,7 @@ class OpenEphysKilosortPipeline:
 
         continuous_file = self._get_raw_data_filepaths()
 
-        lf_dir = self._npx_input_dir.as_posix()
+        lf_dir = self._npx_input_posix
         try:
             # old probe folder convention with 100.0, 100.1, 100.2, 100.3, etc.
             name, num = re.search(r"(.+\.)(\d)+$", lf_dir).groups()
@@ -490,21 +716,20 @@ class OpenEphysKilosortPipeline:
         params = {}
         for k, v in self._params.items():
             value = str(v) if isinstance(v, list) else v
-            if f"ks_{k}" in self._input_json_args:
-                params[f"ks_{k}"] = value
-            if k in self._input_json_args:
-                params[k] = value
+            for valid_key in (k, f"ks_{k}"):
+                if valid_key in self._input_json_args:
+                    params[valid_key] = value
 
         self.ks_input_params = createInputJson(
             self._module_input_json.as_posix(),
             KS2ver=self._KS2ver,
-            npx_directory=self._npx_input_dir.as_posix(),
+            npx_directory=self._npx_input_posix,
             spikeGLX_data=False,
             continuous_file=continuous_file.as_posix(),
             lf_file=lf_file.as_posix(),
-            extracted_data_directory=self._ks_output_dir.as_posix(),
-            kilosort_output_directory=self._ks_output_dir.as_posix(),
-            kilosort_output_tmp=self._ks_output_dir.as_posix(),
+            extracted_data_directory=self._ks_output_posix,
+            kilosort_output_directory=self._ks_output_posix,
+            kilosort_output_tmp=self._ks_output_posix,
             ks_make_copy=True,
             noise_template_use_rf=self._params.get("noise_template_use_rf", False),
             use_C_Waves=False,
@@ -515,73 +740,88 @@ class OpenEphysKilosortPipeline:
             **params,
         )
 
-        self._modules_input_hash = dict_to_uuid(dict(self._params, KS2ver=self._KS2ver))
+        if self._modules_input_hash is None:
+            # params and KS version are fixed for this object - compute once
+            self._modules_input_hash = _fast_dict_hash(
+                dict(self._params, KS2ver=self._KS2ver)
+            )
 
     def run_modules(self, modules_to_run=None):
+        modules = modules_to_run or self._modules
+        if self._all_modules_completed(modules):
+            print("---- All modules already completed - skipping ----")
+            return
+
         print("---- Running Modules ----")
         self.generate_modules_input_json()
         module_input_json = self._module_input_json.as_posix()
         module_logfile = self._module_logfile.as_posix()
 
-        modules = modules_to_run or self._modules
-
-        for module in modules:
-            module_status = self._get_module_status(module)
-            if module_status["completion_time"] is not None:
-                continue
+        # open the run log once, line-buffered, shared by all modules
+        # (fewer open/close syscalls and friendlier to "tail -f")
+        with open(module_logfile, "a", buffering=1) as log_f:
+            for module in modules:
+                module_status = self._get_module_status(module)
+                if module_status["completion_time"] is not None:
+                    continue
 
-            if module == "median_subtraction":
-                median_subtraction_duration = (
-                    self._get_median_subtraction_duration_from_log()
+                if module == "median_subtraction":
+                    median_subtraction_duration = (
+                        self._get_median_subtraction_duration_from_log()
+                    )
+                    if median_subtraction_duration is not None:
+                        median_subtraction_status = self._get_module_status(
+                            "median_subtraction"
+                        )
+                        median_subtraction_status["duration"] = (
+                            median_subtraction_duration
+                        )
+                        median_subtraction_status["completion_time"] = _as_datetime(
+                            median_subtraction_status["start_time"]
+                        ) + timedelta(seconds=median_subtraction_status["duration"])
+                        self._update_module_status(
+                            {"median_subtraction": median_subtraction_status}
+                        )
+                        continue
+
+                module_output_json = self._get_module_output_json_filename(module)
+
+                # duration is measured on the monotonic clock - immune to wall-clock steps
+                start_time = datetime.utcnow()
+                t0 = time.perf_counter_ns()
+                log_f.write(f"\n---- {module} - started at {start_time} ----\n")
+                self._update_module_status(
+                    {
+                        module: {
+                            "start_time": start_time,
+                            "completion_time": None,
+                            "duration": None,
+                        }
+                    }
                 )
-                if median_subtraction_duration is not None:
-                    median_subtraction_status = self._get_module_status(
-                        "median_subtraction"
+                if _ecephys_importable:
+                    _run_module_in_process(
+                        module, module_input_json, module_output_json, log_f
                     )
-                    median_subtraction_status["duration"] = median_subtraction_duration
-                    median_subtraction_status["completion_time"] = datetime.strptime(
-                        median_subtraction_status["start_time"], "%Y-%m-%d %H:%M:%S.%f"
-                    ) + timedelta(seconds=median_subtraction_status["duration"])
-                    self._update_module_status(
-                        {"median_subtraction": median_subtraction_status}
+                else:
+                    _spawn_module(
+                        module,
+                        module_input_json,
+                        module_output_json,
+                        stdout=log_f,
+                        stderr=subprocess.STDOUT,
                     )
-                    continue
-
-            module_output_json = self._get_module_output_json_filename(module)
-            command = [
-                sys.executable,
-                "-W",
-                "ignore",
-                "-m",
-                "ecephys_spike_sorting.modules." + module,
-                "--input_json",
-                module_input_json,
-                "--output_json",
-                module_output_json,
-            ]
-
-            start_time = datetime.utcnow()
-            self._update_module_status(
-                {
-                    module: {
-                        "start_time": start_time,
-                        "completion_time": None,
-                        "duration": None,
-                    }
-                }
-            )
-            with open(module_logfile, "a") as f:
-                subprocess.check_call(command, stdout=f)
-            completion_time = datetime.utcnow()
-            self._update_module_status(
-                {
-                    module: {
-                        "start_time": start_time,
-                        "completion_time": completion_time,
-                        "duration": (completion_time - start_time).total_seconds(),
+                duration = (time.perf_counter_ns() - t0) / 1e9
+                completion_time = datetime.utcnow()
+                self._update_module_status(
+                    {
+                        module: {
+                            "start_time": start_time,
+                            "completion_time": completion_time,
+                            "duration": duration,
+                        }
                     }
-                }
-            )
+                )
 
         self._update_total_duration()
 
@@ -605,7 +845,30 @@ class OpenEphysKilosortPipeline:
         shutil.copy2(raw_ap_fp, continuous_file)
         return continuous_file
 
-    def _update_module_status(self, updated_module_status={}):
+    def _all_modules_completed(self, modules):
+        """
+        Cheap completion probe - reads the expected status file directly so a
+        fully-completed rerun can return before regenerating the input JSONs
+        (createInputJson re-probes the recording metadata, which is expensive)
+        """
+        hash_fp = (
+            self._json_directory
+            / f".{_fast_dict_hash(dict(self._params, KS2ver=self._KS2ver))}.json"
+        )
+        if not hash_fp.exists():
+            return False
+        with open(hash_fp) as f:
+            modules_status = _json_loads(f.read())
+        return all(
+            modules_status.get(m, {}).get("completion_time") is not None
+            for m in modules
+        )
+
+    def _load_modules_status(self):
+        """
+        Load the module-status file into the in-memory cache - parsed once per run
+        instead of re-read for every module
+        """
         if self._modules_input_hash is None:
             raise RuntimeError('"generate_modules_input_json()" not yet performed!')
 
@@ -614,8 +877,7 @@ class OpenEphysKilosortPipeline:
         )
         if self._modules_input_hash_fp.exists():
             with open(self._modules_input_hash_fp) as f:
-                modules_status = json.load(f)
-            modules_status = {**modules_status, **updated_module_status}
+                self._modules_status_cache = _json_loads(f.read())
         else:
             # handle cases of processing rerun on different parameters (the hash changes)
             # delete outdated files
@@ -625,40 +887,49 @@ class OpenEphysKilosortPipeline:
                 if f.is_file() and f.name != self._module_input_json.name
             ]
 
-            modules_status = {
+            self._modules_status_cache = {
                 module: {"start_time": None, "completion_time": None, "duration": None}
                 for module in self._modules
             }
-        with open(self._modules_input_hash_fp, "w") as f:
-            json.dump(modules_status, f, default=str)
+            self._flush_modules_status()
+        return self._modules_status_cache
+
+    def _flush_modules_status(self):
+        # write-temp-then-rename (atomic on POSIX and Windows) so a crash
+        # mid-write cannot corrupt the status file - losing it would re-run
+        # every module, including kilosort itself
+        tmp_fp = self._modules_input_hash_fp.with_suffix(".json.tmp")
+        with open(tmp_fp, "w") as f:
+            f.write(_json_dumps(self._modules_status_cache))
+        os.replace(tmp_fp, self._modules_input_hash_fp)
 
-    def _get_module_status(self, module):
-        if self._modules_input_hash_fp is None:
-            self._update_module_status()
-
-        if self._modules_input_hash_fp.exists():
-            with open(self._modules_input_hash_fp) as f:
-                modules_status = json.load(f)
-            if modules_status[module]["completion_time"] is None:
-                # additional logic to read from the "-output.json" file for this module as well
-                # handle cases where the module has finished successfully,
-                # but the "_modules_input_hash_fp" is not updated (for whatever reason),
-                # resulting in this module not registered as completed in the "_modules_input_hash_fp"
-                module_output_json_fp = pathlib.Path(
-                    self._get_module_output_json_filename(module)
-                )
-                if module_output_json_fp.exists():
-                    with open(module_output_json_fp) as f:
-                        module_run_output = json.load(f)
-                    modules_status[module]["duration"] = module_run_output[
-                        "execution_time"
-                    ]
-                    modules_status[module]["completion_time"] = datetime.strptime(
-                        modules_status[module]["start_time"], "%Y-%m-%d %H:%M:%S.%f"
-                    ) + timedelta(seconds=module_run_output["execution_time"])
-            return modules_status[module]
+    def _update_module_status(self, updated_module_status={}):
+        if self._modules_status_cache is None:
+            self._load_modules_status()
+        self._modules_status_cache.update(updated_module_status)
+        self._flush_modules_status()
 
-        return {"start_time": None, "completion_time": None, "duration": None}
+    def _get_module_status(self, module):
+        if self._modules_status_cache is None:
+            self._load_modules_status()
+
+        modules_status = self._modules_status_cache
+        if modules_status[module]["completion_time"] is None:
+            # additional logic to read from the "-output.json" file for this module as well
+            # handle cases where the module has finished successfully,
+            # but the "_modules_input_hash_fp" is not updated (for whatever reason),
+            # resulting in this module not registered as completed in the "_modules_input_hash_fp"
+            module_output_json_fp = pathlib.Path(
+                self._get_module_output_json_filename(module)
+            )
+            if module_output_json_fp.exists():
+                with open(module_output_json_fp) as f:
+                    module_run_output = _json_loads(f.read())
+                modules_status[module]["duration"] = module_run_output["execution_time"]
+                modules_status[module]["completion_time"] = _as_datetime(
+                    modules_status[module]["start_time"]
+                ) + timedelta(seconds=module_run_output["execution_time"])
+        return modules_status[module]
 
     def _get_module_output_json_filename(self, module):
         module_input_json = self._module_input_json.as_posix()
@@ -669,8 +940,7 @@ class OpenEphysKilosortPipeline:
         return module_output_json
 
     def _update_total_duration(self):
-        with open(self._modules_input_hash_fp) as f:
-            modules_status = json.load(f)
+        modules_status = self._modules_status_cache or self._load_modules_status()
         cumulative_execution_duration = sum(
             v["duration"] or 0
             for k, v in modules_status.items()
@@ -691,11 +961,7 @@ class OpenEphysKilosortPipeline:
             return
 
         total_duration = (
-            datetime.strptime(
-                last_completion_time,
-                "%Y-%m-%d %H:%M:%S.%f",
-            )
-            - datetime.strptime(first_start_time, "%Y-%m-%d %H:%M:%S.%f")
+            _as_datetime(last_completion_time) - _as_datetime(first_start_time)
         ).total_seconds()
         self._update_module_status(
             {
@@ -719,7 +985,7 @@ class OpenEphysKilosortPipeline:
                         ) and previous_line.startswith("Total processing time:"):
                             # regex to search for the processing duration - a float value
                             duration = int(
-                                re.search("\d+\.?\d+", previous_line).group()
+                                re.search(r"\d+\.?\d+", previous_line).group()
                             )
                             return duration
                         previous_line = line
@@ -759,11 +1025,83 @@ def run_pykilosort(
     )
 
 
+def _fast_dict_hash(d):
+    """
+    Hash a parameter dict into a uuid - a blake2b digest over the canonical
+    (key-sorted) JSON of the dict, cheaper than a generic key-by-key md5 walk.
+    Only used to key the per-run module-status files under "json_configs"
+    """
+    return uuid.UUID(
+        bytes=hashlib.blake2b(_canonical_dumps(d), digest_size=16).digest()
+    )
+
+
+def _as_datetime(value):
+    """
+    Module status timestamps are datetime objects in memory but strings once
+    round-tripped through the status file - accept either
+    """
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
+    return value
+
+
+def _spawn_module(
+    module, module_input_json, module_output_json, stdout=None, stderr=None
+):
+    """
+    Run an "ecephys_spike_sorting" module in a subprocess, blocking until it
+    finishes - single argv-building site shared by CatGT and the module runners
+    """
+    argv = [
+        sys.executable,
+        "-W",
+        "ignore",
+        "-m",
+        f"ecephys_spike_sorting.modules.{module}",
+        "--input_json",
+        module_input_json,
+        "--output_json",
+        module_output_json,
+    ]
+    return subprocess.check_call(argv, stdout=stdout, stderr=stderr)
+
+
+def _run_module_in_process(module, module_input_json, module_output_json, log_f):
+    """
+    Run an "ecephys_spike_sorting" module within the current interpreter, equivalent to
+     `python -W ignore -m ecephys_spike_sorting.modules.<module> --input_json ... --output_json ...`
+    but without paying the interpreter startup and numpy/scipy import cost for every module
+    """
+    argv = [
+        module,
+        "--input_json",
+        module_input_json,
+        "--output_json",
+        module_output_json,
+    ]
+    original_argv = sys.argv
+    sys.argv = argv
+    try:
+        with contextlib.redirect_stdout(log_f):
+            runpy.run_module(
+                f"ecephys_spike_sorting.modules.{module}", run_name="__main__"
+            )
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise subprocess.CalledProcessError(e.code, argv)
+    finally:
+        sys.argv = original_argv
+
+
+@functools.lru_cache(maxsize=None)
 def _get_kilosort_repository(KS2ver):
     """
     Get the path to where the kilosort package is installed at, assuming it can be found
     as environment variable named "kilosort_repository"
     Modify this path according to the KSVer used
+    Cached per KSVer - the env lookup and the existence checks ("stat" calls,
+    potentially on a network mount) need only happen once
     """
     ks_repo = pathlib.Path(os.getenv("kilosort_repository"))
     assert ks_repo.exists()